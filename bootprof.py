@@ -0,0 +1,49 @@
+from ticks import ticks_us, ticks_diff
+
+
+class _Step:
+    def __init__(self, profiler: "BootProfiler", name: str):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = ticks_us()
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler.steps.append((self._name, ticks_diff(ticks_us(), self._start)))
+        return False
+
+
+class BootProfiler:
+    def __init__(self):
+        self._start = ticks_us()
+        self.steps: list[tuple[str, int]] = []
+        # us from boot until the buttons were being watched
+        self.responsive_us = None
+        # us from boot until every layout object was built
+        self.layout_ready_us = None
+
+    def step(self, name: str) -> _Step:
+        return _Step(self, name)
+
+    def run(self, name: str, func, *args, **kwargs):
+        with self.step(name):
+            return func(*args, **kwargs)
+
+    def responsive(self):
+        if self.responsive_us is None:
+            self.responsive_us = ticks_diff(ticks_us(), self._start)
+
+    def layout_ready(self):
+        if self.layout_ready_us is None:
+            self.layout_ready_us = ticks_diff(ticks_us(), self._start)
+
+    def report(self):
+        for name, us in self.steps:
+            print("{}: {}ms".format(name, us // 1000))
+        if self.responsive_us is not None:
+            print("responsive after: {}ms".format(self.responsive_us // 1000))
+        if self.layout_ready_us is not None:
+            print("layout ready after: {}ms".format(self.layout_ready_us // 1000))
+        print("total: {}ms".format(ticks_diff(ticks_us(), self._start) // 1000))
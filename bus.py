@@ -0,0 +1,184 @@
+from ticks import ticks_ms, ticks_diff, sleep_us
+
+# MCP23017 registers IODIRA..OLATB in the BANK=0 layout used by this layout
+_IMAGE_SIZE = 0x16
+_IOCON = 0x0A
+_GPPU = 0x0C
+_INTF = 0x0E
+_GPIO = 0x12
+_OLAT = 0x14
+# register pairs that are one latch on the chip: both IOCON addresses, and
+# GPIO/OLAT of each port (writing GPIO writes OLAT)
+_ALIASES = ((_IOCON, _IOCON + 1), (_GPIO, _OLAT), (_GPIO + 1, _OLAT + 1))
+
+
+class ResilientI2C:
+    # Wraps the I2C object given to MCP23017. Transient errors are retried
+    # with bounded exponential backoff; a device that keeps failing is
+    # quarantined and served from its last known register values, so the
+    # rest of the layout keeps polling. Quarantined devices are probed every
+    # probe_every_ms and, once they answer, re-initialised by writing back
+    # the cached register image.
+
+    def __init__(
+        self,
+        i2c,
+        *,
+        retries: int = 2,
+        backoff_us: int = 200,
+        max_backoff_us: int = 2000,
+        quarantine_after: int = 3,
+        probe_every_ms: int = 1000,
+        on_fault=None,
+    ):
+        self._i2c = i2c
+        self.retries = retries
+        self.backoff_us = backoff_us
+        self.max_backoff_us = max_backoff_us
+        self.quarantine_after = quarantine_after
+        self.probe_every_ms = probe_every_ms
+        self.on_fault = on_fault
+        # addr -> last written / last read value of every register
+        self._written: dict[int, bytearray] = {}
+        self._read: dict[int, bytearray] = {}
+        self._failures: dict[int, int] = {}
+        # addr -> ticks_ms of the last probe
+        self.quarantined: dict[int, int] = {}
+        # addresses with a swallowed write, re-synced on the next success
+        self._dirty: dict[int, bool] = {}
+        self.errors = 0
+        self.recoveries = 0
+
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+    def _attempt(self, func, *args):
+        delay = self.backoff_us
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except OSError:
+                self.errors += 1
+                if attempt == self.retries:
+                    raise
+                sleep_us(delay)
+                delay = min(delay * 2, self.max_backoff_us)
+
+    def _image(self, images, addr):
+        image = images.get(addr)
+        if image is None:
+            image = images[addr] = bytearray(_IMAGE_SIZE)
+            if images is self._read:
+                # inputs are pulled high, so idle until the first real read
+                image[_INTF:_OLAT] = b"\xff" * (_OLAT - _INTF)
+        return image
+
+    def _store(self, images, addr, memaddr, buf):
+        image = self._image(images, addr)
+        for i, value in enumerate(buf):
+            reg = memaddr + i
+            if reg < _IMAGE_SIZE:
+                image[reg] = value
+
+    def _cached(self, addr, memaddr, nbytes):
+        # INTF..GPIOB reflect the pins, everything else holds what we wrote
+        read = self._image(self._read, addr)
+        written = self._image(self._written, addr)
+        return bytes(
+            (read if _INTF <= reg < _OLAT else written)[reg]
+            for reg in range(memaddr, min(memaddr + nbytes, _IMAGE_SIZE))
+        )
+
+    def _restore(self, addr):
+        # IOCON first so the rest lands in the expected bank, then everything
+        # writable; INTF/INTCAP are read-only and GPIO is OLAT
+        image = self._image(self._written, addr)
+        self._i2c.writeto_mem(addr, _IOCON, image[_IOCON : _IOCON + 1])
+        self._i2c.writeto_mem(addr, 0, image[:_IOCON])
+        self._i2c.writeto_mem(addr, _GPPU, image[_GPPU:_INTF])
+        self._i2c.writeto_mem(addr, _OLAT, image[_OLAT:_IMAGE_SIZE])
+
+    def _fault(self, addr, quarantined):
+        if self.on_fault is None:
+            print(
+                "MCP23017 {:#x} {}".format(
+                    addr, "quarantined" if quarantined else "recovered"
+                )
+            )
+        else:
+            self.on_fault(addr, quarantined)
+
+    def _failed(self, addr):
+        failures = self._failures.get(addr, 0) + 1
+        self._failures[addr] = failures
+        if failures >= self.quarantine_after and addr not in self.quarantined:
+            self.quarantined[addr] = ticks_ms()
+            self._fault(addr, True)
+
+    def _available(self, addr):
+        last_probe = self.quarantined.get(addr)
+        if last_probe is None:
+            return True
+        now = ticks_ms()
+        if ticks_diff(now, last_probe) < self.probe_every_ms:
+            return False
+        self.quarantined[addr] = now
+        try:
+            self._i2c.readfrom_mem(addr, _IOCON, 1)
+            self._restore(addr)
+        except OSError:
+            self.errors += 1
+            return False
+        del self.quarantined[addr]
+        self._dirty.pop(addr, None)
+        self._failures[addr] = 0
+        self.recoveries += 1
+        self._fault(addr, False)
+        return True
+
+    def _succeeded(self, addr):
+        self._failures[addr] = 0
+        if addr in self._dirty:
+            # a write was lost; the driver cached it as done, so write the
+            # whole image back rather than trusting the device
+            try:
+                self._attempt(self._restore, addr)
+            except OSError:
+                self._failed(addr)
+                return
+            del self._dirty[addr]
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        if not self._available(addr):
+            return self._cached(addr, memaddr, nbytes)
+        try:
+            data = self._attempt(self._i2c.readfrom_mem, addr, memaddr, nbytes)
+        except OSError:
+            self._failed(addr)
+            return self._cached(addr, memaddr, nbytes)
+        self._succeeded(addr)
+        self._store(self._read, addr, memaddr, data)
+        return data
+
+    def writeto_mem(self, addr, memaddr, buf):
+        # the image records the intended state even if the write is lost
+        self._store(self._written, addr, memaddr, buf)
+        image = self._written[addr]
+        # keep both addresses of an aliased register in the image; in a burst
+        # covering both, the later one is what the chip ends up with
+        end = memaddr + len(buf)
+        for first, second in _ALIASES:
+            if memaddr <= second < end:
+                image[first] = image[second]
+            elif memaddr <= first < end:
+                image[second] = image[first]
+        if not self._available(addr):
+            self._dirty[addr] = True
+            return
+        try:
+            self._attempt(self._i2c.writeto_mem, addr, memaddr, buf)
+        except OSError:
+            self._dirty[addr] = True
+            self._failed(addr)
+            return
+        self._succeeded(addr)
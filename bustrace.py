@@ -0,0 +1,183 @@
+import struct
+
+from ticks import ticks_us, ticks_diff
+
+# record: <ticks_us:u32><addr:u8><reg:u8><op|len:u8> then len data bytes,
+# where the top bit of op|len is set for writes
+_HEADER = "<IBBB"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_WRITE = 0x80
+_MAX_DATA = 0x7F
+
+READ = "read"
+WRITE = "write"
+
+
+class RecordingI2C:
+    def __init__(self, i2c, size: int = 4096):
+        self._i2c = i2c
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._used = 0
+        self.dropped = 0
+
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        data = self._i2c.readfrom_mem(addr, memaddr, nbytes)
+        self._record(addr, memaddr, 0, data)
+        return data
+
+    def writeto_mem(self, addr, memaddr, buf):
+        result = self._i2c.writeto_mem(addr, memaddr, buf)
+        self._record(addr, memaddr, _WRITE, buf)
+        return result
+
+    def _record(self, addr, memaddr, op, data):
+        data = bytes(data[:_MAX_DATA])
+        record = struct.pack(_HEADER, ticks_us(), addr, memaddr, op | len(data))
+        record += data
+        size = len(self._buffer)
+        if len(record) > size:
+            return
+        # make room by discarding the oldest records
+        while size - self._used < len(record):
+            length = self._peek(self._start + _HEADER_SIZE - 1) & _MAX_DATA
+            self._start = (self._start + _HEADER_SIZE + length) % size
+            self._used -= _HEADER_SIZE + length
+            self.dropped += 1
+        end = (self._start + self._used) % size
+        first = min(len(record), size - end)
+        self._buffer[end : end + first] = record[:first]
+        self._buffer[: len(record) - first] = record[first:]
+        self._used += len(record)
+
+    def _peek(self, offset):
+        return self._buffer[offset % len(self._buffer)]
+
+    def clear(self):
+        self._start = 0
+        self._used = 0
+        self.dropped = 0
+
+    def dump(self) -> bytes:
+        end = self._start + self._used
+        if end <= len(self._buffer):
+            return bytes(self._buffer[self._start : end])
+        return bytes(self._buffer[self._start :]) + bytes(
+            self._buffer[: end - len(self._buffer)]
+        )
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.dump())
+
+
+def records(data: bytes):
+    offset = 0
+    while offset + _HEADER_SIZE <= len(data):
+        timestamp, addr, reg, oplen = struct.unpack_from(_HEADER, data, offset)
+        offset += _HEADER_SIZE
+        length = oplen & _MAX_DATA
+        yield (
+            timestamp,
+            WRITE if oplen & _WRITE else READ,
+            addr,
+            reg,
+            bytes(data[offset : offset + length]),
+        )
+        offset += length
+
+
+def load(path: str) -> list:
+    with open(path, "rb") as f:
+        return list(records(f.read()))
+
+
+class ReplayI2C:
+    # Serves reads from a recorded trace so layout logic can be re-run off
+    # the device. Time is a trace clock (now_us, from the first record) that
+    # only advance() moves: a read returns the value the device returned most
+    # recently at that moment, however often the driver asks for it. Writes
+    # are applied to a register model and counted, so driver changes can be
+    # compared on the same input.
+
+    def __init__(self, trace: list):
+        self._reads = {}
+        self._next = {}
+        self._registers = {}
+        elapsed = 0
+        previous = None
+        for timestamp, op, addr, reg, data in trace:
+            # unwrap the ticks_us timestamps into us since the first record
+            if previous is not None:
+                elapsed += max(0, ticks_diff(timestamp, previous))
+            previous = timestamp
+            if op == READ:
+                self._reads.setdefault((addr, reg), []).append((elapsed, data))
+        self._addresses = sorted({addr for _, _, addr, _, _ in trace})
+        self.end_us = elapsed
+        self.now_us = 0
+        self.reads = 0
+        self.writes = 0
+        self.log = []
+
+    def advance(self, us: int):
+        self.now_us += us
+
+    def scan(self):
+        return list(self._addresses)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        self.reads += 1
+        self.log.append((self.now_us, READ, addr, memaddr))
+        key = (addr, memaddr)
+        recorded = self._reads.get(key)
+        if recorded:
+            index = self._next.get(key, 0)
+            while index + 1 < len(recorded) and recorded[index + 1][0] <= self.now_us:
+                index += 1
+            self._next[key] = index
+            data = recorded[index][1]
+            if len(data) >= nbytes:
+                return data[:nbytes]
+        registers = self._registers.get(addr, {})
+        return bytes(registers.get(memaddr + i, 0) for i in range(nbytes))
+
+    def writeto_mem(self, addr, memaddr, buf):
+        self.writes += 1
+        self.log.append((self.now_us, WRITE, addr, memaddr, bytes(buf)))
+        registers = self._registers.setdefault(addr, {})
+        for i, value in enumerate(buf):
+            registers[memaddr + i] = value
+
+
+def replay(trace: list, build, *, tick_ms: int = 200) -> ReplayI2C:
+    # CPython only: builds a fresh layout with build(i2c) and steps the main
+    # loop every tick_ms of trace time, with units' timing on the trace clock
+    import ticks
+    from units import Base, Snapshot, Switch, RouteTable
+
+    i2c = ReplayI2C(trace)
+    ticks.use_clock(lambda: i2c.now_us)
+    try:
+        Base.instances.clear()
+        Base.deferred.clear()
+        Base.listeners.clear()
+        build(i2c)
+        while Base.materialise_next():
+            pass
+        snapshot = Snapshot.for_layout()
+        Switch.routes = RouteTable.for_layout()
+        while i2c.now_us <= i2c.end_us:
+            snapshot.capture()
+            Base.poll_all_switches(snapshot)
+            Switch.routes.commit()
+            Base.poll_all_states(snapshot)
+            if Switch.effects is not None:
+                Switch.effects.frame()
+            i2c.advance(tick_ms * 1000)
+    finally:
+        ticks.use_clock(None)
+    return i2c
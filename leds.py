@@ -0,0 +1,51 @@
+from ticks import ticks_ms, ticks_diff
+
+from mcp23017 import Port, VirtualPin
+
+# patterns are (period_ms, on_ms); a period of 0 means steady
+OFF = (0, 0)
+STEADY = (0, 1)
+BLINK = (500, 250)
+PULSE = (1000, 100)
+
+
+class Effects:
+    def __init__(self):
+        # port -> mask of the bits owned by effects
+        self._ports: dict[Port, int] = {}
+        self._leds: dict[VirtualPin, tuple[int, int]] = {}
+        self._epoch = ticks_ms()
+        self.writes = 0
+
+    def add(self, led: VirtualPin, pattern: tuple[int, int] = OFF):
+        led.output()
+        port = led._port
+        self._ports[port] = self._ports.get(port, 0) | led._bit
+        self._leds[led] = pattern
+
+    def set(self, led: VirtualPin, pattern: tuple[int, int]):
+        if led not in self._leds:
+            self.add(led, pattern)
+        else:
+            self._leds[led] = pattern
+
+    def frame(self, now: int | None = None):
+        # all patterns share one clock so that blinking LEDs stay in phase
+        if now is None:
+            now = ticks_ms()
+        elapsed = ticks_diff(now, self._epoch)
+        images = {}
+        for led, (period, on) in self._leds.items():
+            port = led._port
+            image = images.get(port, 0)
+            if (elapsed % period < on) if period else on:
+                image |= led._bit
+            images[port] = image
+        for port, image in images.items():
+            # bits we don't own keep whatever the port's latch holds now; the
+            # driver serves output_latch from its register cache
+            current = port.output_latch
+            latch = (current & ~self._ports[port]) | image
+            if latch != current:
+                port.gpio = latch
+                self.writes += 1
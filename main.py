@@ -1,22 +1,44 @@
-import time
+from bootprof import BootProfiler
 
-import machine
+boot = BootProfiler()
 
-from units import Base, Sidings, PairedTurnout, Turnout, Crossover
+with boot.step("imports"):
+    import time
 
-from mcp23017 import MCP23017
+    import machine
 
-i2c1 = machine.I2C(1)
+    from bus import ResilientI2C
+    from leds import Effects
+    from profiler import TickProfiler
+    from telemetry import Telemetry
+    from units import (
+        Base,
+        Sidings,
+        PairedTurnout,
+        Turnout,
+        Crossover,
+        Switch,
+        Snapshot,
+        RouteTable,
+    )
+
+    from mcp23017 import MCP23017
+
+profiler = TickProfiler()
 
+i2c1 = profiler.wrap_i2c(ResilientI2C(machine.I2C(1)))
 
-MCPT1 = MCP23017(i2c1, address=0x21)
-MCPT2 = MCP23017(i2c1, address=0x24)
-MCPT3 = MCP23017(i2c1, address=0x20)
-MCPB1 = MCP23017(i2c1, address=0x22)
-MCPB2 = MCP23017(i2c1, address=0x23)
+
+MCPT1 = boot.run("MCPT1", MCP23017, i2c1, address=0x21)
+MCPT2 = boot.run("MCPT2", MCP23017, i2c1, address=0x24)
+MCPT3 = boot.run("MCPT3", MCP23017, i2c1, address=0x20)
+MCPB1 = boot.run("MCPB1", MCP23017, i2c1, address=0x22)
+MCPB2 = boot.run("MCPB2", MCP23017, i2c1, address=0x23)
+
+Switch.effects = Effects()
 
 if True:
-    sidings = Sidings(
+    sidings = Sidings.lazy(
         motor1=MCPT1[0],
         motor2=MCPT1[1],
         motor3=MCPT1[2],
@@ -41,7 +63,7 @@ if True:
         led5=MCPB1[4],
     )
 
-    station_left = PairedTurnout(
+    station_left = PairedTurnout.lazy(
         motor=MCPT1[4],
         sensor1_straight=MCPT2[15],
         sensor1_diverging=MCPT2[14],
@@ -53,7 +75,7 @@ if True:
         led_diverging=MCPB1[6],
     )
 
-    station_right = PairedTurnout(
+    station_right = PairedTurnout.lazy(
         motor=MCPT1[5],
         sensor1_straight=MCPT2[10],
         sensor1_diverging=MCPT2[11],
@@ -65,7 +87,7 @@ if True:
         led_diverging=MCPB2[0],
     )
 
-    program = Turnout(
+    program = Turnout.lazy(
         motor=MCPT1[6],
         sensor_straight=MCPT2[1],
         sensor_diverging=MCPT2[0],
@@ -75,7 +97,7 @@ if True:
         led_diverging=MCPB2[2],
     )
 
-    sidings_entrance = Turnout(
+    sidings_entrance = Turnout.lazy(
         motor=MCPT1[7],
         sensor_straight=MCPT2[3],
         sensor_diverging=MCPT2[2],
@@ -85,7 +107,7 @@ if True:
         led_diverging=MCPB2[4],
     )
 
-    slip = Crossover(
+    slip = Crossover.lazy(
         motor1=MCPT3[0],
         motor2=MCPT3[1],
         sensor1_straight=MCPT2[4],
@@ -104,8 +126,29 @@ if True:
         led_partial=MCPB2[8],
     )
 
+    # only the buttons are configured so far; the layout objects are built
+    # one per tick once the loop is running, or straight away when one of
+    # their buttons is pressed, and added to the snapshot, route table and
+    # telemetry as they appear
+    snapshot = boot.run("snapshot", Snapshot.for_layout)
+    Switch.routes = RouteTable.for_layout()
+    telemetry = Telemetry(machine.UART(0, 115200))
+    boot.responsive()
+    boot.report()
+
     while False:
-        Base.poll_all_switches()
-        time.sleep(0.1)
-        Base.poll_all_states()
-        time.sleep(0.1)
+        if Base.deferred:
+            boot.run(Base.deferred[0].name, Base.materialise_next)
+        elif boot.layout_ready_us is None:
+            # the last object may also have been built by first use
+            boot.layout_ready()
+            boot.report()
+        profiler.start()
+        profiler.run("snapshot", snapshot.capture)
+        profiler.run("switches", Base.poll_all_switches, snapshot)
+        profiler.run("routes", Switch.routes.commit)
+        profiler.run("states", Base.poll_all_states, snapshot)
+        profiler.run("telemetry", telemetry.poll)
+        profiler.run("leds", Switch.effects.frame)
+        profiler.end()
+        time.sleep(0.2)
@@ -26,7 +26,12 @@ SOFTWARE.
 
 __version__ = '0.1.4'
 
-from __builtins__ import const
+try:
+    from __builtins__ import const
+except ImportError:
+    # CPython, e.g. when replaying a bus trace
+    def const(x):
+        return x
 
 # register addresses in port=0, bank=1 mode (easier maths to convert)
 _MCP_IODIR        = const(0x00) # R/W I/O Direction Register
@@ -56,6 +61,10 @@ class Port():
     def __init__(self, port, mcp):
         self._port = port & 1  # 0=PortA, 1=PortB
         self._mcp = mcp
+        # last value written to each register; only we change these, so reads
+        # are served from here and writes of an unchanged value are skipped.
+        # GPIO writes land in OLAT, GPIO reads always go to the device.
+        self._cache = {}
 
     def _which_reg(self, reg):
         if self._mcp._config & 0x80 == 0x80:
@@ -72,11 +81,19 @@ class Port():
             setattr(self, reg, getattr(self, reg) & ~bit)
 
     def _read(self, reg):
+        if reg in self._cache:
+            return self._cache[reg]
         return self._mcp._i2c.readfrom_mem(self._mcp._address, self._which_reg(reg), 1)[0]
 
     def _write(self, reg, val):
         val &= 0xff
+        cached = _MCP_OLAT if reg == _MCP_GPIO else reg
+        if self._cache.get(cached) == val:
+            self._mcp.suppressed += 1
+            return
         self._mcp._i2c.writeto_mem(self._mcp._address, self._which_reg(reg), bytearray([val]))
+        self._mcp.writes += 1
+        self._cache[cached] = val
         # if writing to the config register, make a copy in mcp so that it knows
         # which bank you're using for subsequent writes
         if reg == _MCP_IOCON:
@@ -164,6 +181,9 @@ class MCP23017():
         self._address = address
         self._config = 0x00
         self._virtual_pins = {}
+        # register writes issued, and skipped because the value was unchanged
+        self.writes = 0
+        self.suppressed = 0
         self.init()
 
     def init(self):
@@ -233,6 +253,12 @@ class MCP23017():
         assert 0 <= pin <= 15
         port = self.portb if pin // 8 else self.porta
         bit = (1 << (pin % 8))
+        # each keyword maps to its own register; the new value is built from
+        # the register cache (init() writes every register, and value= starts
+        # from the output latch rather than the pin levels) and unchanged
+        # registers are not rewritten, so configuring costs no reads and at
+        # most one write per changed register. Only returning the pin level
+        # reads the device.
         if mode is not None:
             # 0: Pin is configured as an output
             # 1: Pin is configured as an input
@@ -240,7 +266,8 @@ class MCP23017():
         if value is not None:
             # 0: Pin is set to logic low
             # 1: Pin is set to logic high
-            port._flip_property_bit('gpio', value & 1, bit)
+            latch = port.output_latch
+            port.gpio = latch | bit if value & 1 else latch & ~bit
         if pullup is not None:
             # 0: Weak pull-up 100k ohm resistor disabled
             # 1: Weak pull-up 100k ohm resistor enabled
@@ -394,7 +421,7 @@ class VirtualPin():
     def value(self, val=None):
         # if val, write, else read
         if val is not None:
-            self._port.gpio = self._flip_bit(self._port.gpio, val & 1)
+            self._port.gpio = self._flip_bit(self._port.output_latch, val & 1)
         else:
             return self._get_bit(self._port.gpio)
 
@@ -408,4 +435,4 @@ class VirtualPin():
         # if val, write, else read
         self._port.mode = self._flip_bit(self._port.mode, 0) # mode = output
         if val is not None:
-            self._port.gpio = self._flip_bit(self._port.gpio, val & 1)
+            self._port.gpio = self._flip_bit(self._port.output_latch, val & 1)
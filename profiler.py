@@ -0,0 +1,120 @@
+import struct
+from array import array
+
+from ticks import ticks_us, ticks_diff
+
+
+class PhaseStats:
+    def __init__(self, size: int):
+        self._samples = array("I", [0] * size)
+        self._next = 0
+        self.count = 0
+        self.max_us = 0
+
+    def add(self, us: int):
+        self._samples[self._next] = us
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+        if us > self.max_us:
+            self.max_us = us
+
+    def percentile(self, pct: int) -> int:
+        samples = sorted(self._samples[: min(self.count, len(self._samples))])
+        if not samples:
+            return 0
+        return samples[min(len(samples) - 1, len(samples) * pct // 100)]
+
+    def summary(self) -> tuple[int, int, int]:
+        # p50/p95 cover the ring buffer, max covers every sample since reset
+        return self.percentile(50), self.percentile(95), self.max_us
+
+
+class TimedI2C:
+    def __init__(self, i2c, profiler: "TickProfiler"):
+        self._i2c = i2c
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        start = ticks_us()
+        try:
+            return self._i2c.readfrom_mem(addr, memaddr, nbytes)
+        finally:
+            self._profiler._io_us += ticks_diff(ticks_us(), start)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        start = ticks_us()
+        try:
+            return self._i2c.writeto_mem(addr, memaddr, buf)
+        finally:
+            self._profiler._io_us += ticks_diff(ticks_us(), start)
+
+
+class TickProfiler:
+    def __init__(self, *, deadline_us: int = 50000, size: int = 64, on_overrun=None):
+        self.deadline_us = deadline_us
+        self.on_overrun = on_overrun
+        self._size = size
+        self.reset()
+
+    def reset(self):
+        self.phases: dict[str, PhaseStats] = {}
+        self.ticks = 0
+        self.overruns = 0
+        self._start = None
+        self._io_us = 0
+
+    def _stats(self, name: str) -> PhaseStats:
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats(self._size)
+        return stats
+
+    def wrap_i2c(self, i2c) -> TimedI2C:
+        # time spent on the bus is reported as the "io" phase
+        return TimedI2C(i2c, self)
+
+    def start(self):
+        self._io_us = 0
+        self._start = ticks_us()
+
+    def run(self, name: str, func, *args):
+        start = ticks_us()
+        try:
+            return func(*args)
+        finally:
+            self._stats(name).add(ticks_diff(ticks_us(), start))
+
+    def end(self):
+        elapsed = ticks_diff(ticks_us(), self._start)
+        self.ticks += 1
+        self._stats("io").add(self._io_us)
+        self._stats("tick").add(elapsed)
+        if elapsed > self.deadline_us:
+            self.overruns += 1
+            if self.on_overrun is None:
+                print(
+                    "tick overrun: {}us > {}us (io {}us)".format(
+                        elapsed, self.deadline_us, self._io_us
+                    )
+                )
+            else:
+                self.on_overrun(self, elapsed)
+        return elapsed
+
+    def report(self):
+        print("ticks: {} overruns: {}".format(self.ticks, self.overruns))
+        for name, stats in self.phases.items():
+            print("{}: p50={} p95={} max={}".format(name, *stats.summary()))
+
+    def record(self) -> bytes:
+        # <ticks:u32><overruns:u32><phases:u8> then per phase
+        # <len:u8><name><p50:u32><p95:u32><max:u32>
+        parts = [struct.pack("<IIB", self.ticks, self.overruns, len(self.phases))]
+        for name, stats in self.phases.items():
+            encoded = name.encode()
+            parts.append(struct.pack("<B", len(encoded)) + encoded)
+            parts.append(struct.pack("<III", *stats.summary()))
+        return b"".join(parts)
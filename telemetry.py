@@ -0,0 +1,235 @@
+from units import Base
+
+# frame: <sync:u8><len:u8><type:u8><payload><crc:u8>, len counting type and
+# payload, crc a CRC-8 (poly 0x07) of len+type+payload; a reader that sees a
+# bad frame drops bytes up to the next sync byte
+#   keyframe: <seq:u8><motors:u8><switches:u8> then one value per item
+#   delta:    <seq:u8> then <index:u8><value:u8> per changed item
+#   push:     <switch index:u8> (dashboard -> panel)
+# items are every motor followed by every switch; motor values are
+# 0 unknown, 1 straight, 2 diverging with bit 2 set while moving, switch
+# values are the lit state of its LED
+SYNC = 0xA5
+KEYFRAME = 0x4B
+DELTA = 0x44
+PUSH = 0x50
+
+_POSITIONS = {None: 0, "straight": 1, "diverging": 2}
+_MOVING = 0x04
+
+
+def _crc8(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+
+def encode(kind: int, payload: bytes) -> bytes:
+    body = bytes((len(payload) + 1, kind)) + payload
+    return bytes((SYNC,)) + body + bytes((_crc8(body),))
+
+
+def decode(buffer: bytes):
+    # returns ([type + payload, ...], unconsumed bytes)
+    frames = []
+    while True:
+        start = buffer.find(bytes((SYNC,)))
+        if start < 0:
+            return frames, b""
+        buffer = buffer[start:]
+        if len(buffer) < 2:
+            return frames, buffer
+        length = buffer[1]
+        if not length:
+            buffer = buffer[1:]
+            continue
+        if len(buffer) < length + 3:
+            return frames, buffer
+        body = buffer[1 : length + 2]
+        if body[1] not in (KEYFRAME, DELTA, PUSH) or _crc8(body) != buffer[length + 2]:
+            # corrupt or not really a frame start, resync from the next byte
+            buffer = buffer[1:]
+            continue
+        frames.append(body[1:])
+        buffer = buffer[length + 3 :]
+
+
+class SocketStream:
+    # adapts a socket to the UART-style read()/write() used by Telemetry
+    def __init__(self, sock):
+        self._sock = sock
+        self._sock.setblocking(False)
+
+    def read(self, nbytes: int):
+        try:
+            return self._sock.recv(nbytes) or None
+        except OSError:
+            return None
+
+    def write(self, data: bytes):
+        try:
+            return self._sock.send(data)
+        except OSError:
+            return 0
+
+
+class Telemetry:
+    def __init__(self, stream, *, keyframe_every: int = 50, backlog: int = 256):
+        self._stream = stream
+        self.keyframe_every = keyframe_every
+        self.backlog = backlog
+        self.motors = []
+        self.switches = []
+        for base in Base.instances:
+            self.add(base)
+        Base.listeners.append(self.add)
+        self._sent = None
+        self._since_keyframe = 0
+        self._seq = 0
+        self._rx = b""
+        # bytes not yet accepted by the stream; frames are only delimited by
+        # their length, so a partly sent frame must be finished first
+        self._tx = b""
+
+    def add(self, base: Base):
+        self.motors += base.motors
+        self.switches += base.switches
+        # indices have moved, so the dashboard needs a fresh keyframe
+        self._sent = None
+
+    def _sample(self) -> bytearray:
+        # only looks at state sampled by the poll phases, never the bus
+        values = bytearray(len(self.motors) + len(self.switches))
+        for i, motor in enumerate(self.motors):
+            values[i] = _POSITIONS[motor.position] | (_MOVING if motor.moving else 0)
+        offset = len(self.motors)
+        for i, switch in enumerate(self.switches):
+            values[offset + i] = 1 if switch._last_state else 0
+        return values
+
+    def _send(self, kind: int, payload: bytes):
+        self._tx += encode(kind, payload)
+        self._seq = (self._seq + 1) & 0xFF
+        self._flush()
+
+    def _flush(self):
+        if self._tx:
+            # UART.write() returns None on timeout, sockets may send part
+            sent = self._stream.write(self._tx) or 0
+            self._tx = self._tx[sent:]
+
+    def keyframe(self):
+        values = self._sample()
+        header = bytes((self._seq, len(self.motors), len(self.switches)))
+        self._send(KEYFRAME, header + values)
+        self._sent = values
+        self._since_keyframe = 0
+
+    def poll(self):
+        self._receive()
+        self._flush()
+        if len(self._tx) > self.backlog:
+            # the link is not keeping up: stop queueing deltas and resync
+            # with a keyframe once the backlog has drained
+            self._sent = None
+            return
+        if self._sent is None or self._since_keyframe >= self.keyframe_every:
+            self.keyframe()
+            return
+        self._since_keyframe += 1
+        values = self._sample()
+        changes = bytearray()
+        for i, value in enumerate(values):
+            if value != self._sent[i]:
+                changes.append(i)
+                changes.append(value)
+        if changes:
+            self._send(DELTA, bytes((self._seq,)) + changes)
+            self._sent = values
+
+    def _receive(self):
+        data = self._stream.read(64)
+        if data:
+            self._rx += data
+        frames, self._rx = decode(self._rx)
+        for frame in frames:
+            if len(frame) == 2 and frame[0] == PUSH and frame[1] < len(self.switches):
+                self.switches[frame[1]].request()
+
+
+class Mirror:
+    # dashboard side: rebuilds the panel state from a telemetry stream
+    def __init__(self):
+        self.motors = bytearray()
+        self.switches = bytearray()
+        self.synced = False
+        self._seq = None
+        self._rx = b""
+
+    def feed(self, data: bytes):
+        self._rx += data
+        frames, self._rx = decode(self._rx)
+        for frame in frames:
+            if not self._apply(frame):
+                # malformed or out of sequence, wait for the next keyframe
+                self.synced = False
+
+    def _apply(self, frame: bytes) -> bool:
+        if len(frame) < 2:
+            return False
+        kind, seq, payload = frame[0], frame[1], frame[2:]
+        if kind == KEYFRAME:
+            if len(payload) < 2 or len(payload) != 2 + payload[0] + payload[1]:
+                return False
+            motors = payload[0]
+            self.motors = bytearray(payload[2 : 2 + motors])
+            self.switches = bytearray(payload[2 + motors :])
+            self.synced = True
+        elif kind == DELTA:
+            if not self.synced:
+                return True
+            if seq != (self._seq + 1) & 0xFF or len(payload) % 2:
+                return False
+            items = len(self.motors) + len(self.switches)
+            for i in range(0, len(payload), 2):
+                if payload[i] >= items:
+                    return False
+            for i in range(0, len(payload), 2):
+                index, value = payload[i], payload[i + 1]
+                if index < len(self.motors):
+                    self.motors[index] = value
+                else:
+                    self.switches[index - len(self.motors)] = value
+        else:
+            return False
+        self._seq = seq
+        return True
+
+    @staticmethod
+    def push(index: int) -> bytes:
+        return encode(PUSH, bytes((index,)))
+
+
+def check_loopback(polls: int = 3) -> bool:
+    # CPython/Linux: round-trips the current layout through a socket pair,
+    # with line noise before the stream, and checks the mirror matches
+    import socket
+
+    panel, dashboard = socket.socketpair()
+    dashboard = SocketStream(dashboard)
+    try:
+        telemetry = Telemetry(SocketStream(panel))
+        mirror = Mirror()
+        mirror.feed(bytes((SYNC, 0, SYNC, 7, 1, 2)))
+        for _ in range(polls):
+            telemetry.poll()
+            mirror.feed(dashboard.read(4096) or b"")
+        values = telemetry._sample()
+        return mirror.synced and mirror.motors + mirror.switches == values
+    finally:
+        Base.listeners.remove(telemetry.add)
+        panel.close()
+        dashboard._sock.close()
@@ -0,0 +1,38 @@
+try:
+    from time import ticks_ms, ticks_us, ticks_add, ticks_diff, sleep_ms, sleep_us
+except ImportError:
+    # CPython: emulate MicroPython's wrapping tick counters
+    import time
+
+    _TICKS_PERIOD = 1 << 30
+    _TICKS_MAX = _TICKS_PERIOD - 1
+    _TICKS_HALF = _TICKS_PERIOD // 2
+
+    _clock = None
+
+    def use_clock(clock):
+        # drive the ticks from clock(), in us, instead of the wall clock;
+        # bustrace.replay() uses this to run the layout on trace time
+        global _clock
+        _clock = clock
+
+    def _now_us():
+        return int(time.monotonic() * 1000000) if _clock is None else _clock()
+
+    def ticks_ms():
+        return (_now_us() // 1000) & _TICKS_MAX
+
+    def ticks_us():
+        return _now_us() & _TICKS_MAX
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
+    def ticks_diff(ticks1, ticks2):
+        return ((ticks1 - ticks2 + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+    def sleep_us(us):
+        time.sleep(us / 1000000)
@@ -1,18 +1,87 @@
-import time
-
 try:
-    from __future__ import annotations
     from typing import ClassVar
 except ImportError:
     pass
 
-from mcp23017 import VirtualPin
+import leds
+from mcp23017 import Port, VirtualPin
+from ticks import ticks_ms, ticks_diff
 
 PULL_HIGH = True
 ON = False
 OFF = True
 
 
+class Snapshot:
+    def __init__(self, ports: list[Port]):
+        self.ports = ports
+        # double buffered: capture() keeps the previous frame for edges
+        self.current = {port: 0xFF for port in ports}
+        self.previous = {port: 0xFF for port in ports}
+
+    @classmethod
+    def for_layout(cls) -> "Snapshot":
+        snapshot = cls([])
+        for instance in Base.instances:
+            snapshot.add(instance)
+        for lazy in Base.deferred:
+            # watch the buttons of objects not built yet, see Base.poll_all_switches
+            snapshot.add_ports([pin._port for pin in lazy.inputs])
+        Base.listeners.append(snapshot.add)
+        return snapshot
+
+    def add(self, instance: "Base"):
+        ports = [port for motor in instance.motors for port in motor._sensors]
+        ports += [switch.switch._port for switch in instance.switches]
+        self.add_ports(ports)
+
+    def add_ports(self, ports: list[Port]):
+        for port in ports:
+            if port not in self.current:
+                self.ports.append(port)
+                # seed both frames so a new port shows no edge on its first tick
+                self.current[port] = self.previous[port] = port.gpio
+
+    def capture(self):
+        self.previous, self.current = self.current, self.previous
+        for port in self.ports:
+            self.current[port] = port.gpio
+
+    def value(self, pin: VirtualPin) -> int:
+        return pin._get_bit(self.current[pin._port])
+
+    def fell(self, pin: VirtualPin) -> bool:
+        return not self.current[pin._port] & pin._bit and bool(
+            self.previous[pin._port] & pin._bit
+        )
+
+
+class ThrowStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0
+        self.min_ms = None
+        self.max_ms = None
+        self.timeouts = 0
+
+    def record(self, ms: int):
+        self.count += 1
+        self.total_ms += ms
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+        if self.max_ms is None or ms > self.max_ms:
+            self.max_ms = ms
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else None
+
+    def __repr__(self):
+        return "<ThrowStats n={} min={} mean={} max={} timeouts={}>".format(
+            self.count, self.min_ms, self.mean_ms, self.max_ms, self.timeouts
+        )
+
+
 class Motor:
     def __init__(
         self,
@@ -20,45 +89,125 @@ class Motor:
         motor: VirtualPin,
         straight: list[VirtualPin],
         diverging: list[VirtualPin],
+        timeout_ms: int = 5000,
     ):
         self._motor = motor
         self._straight = straight
         self._diverging = diverging
+        # port -> [straight mask, diverging mask], so each port is read once
+        self._sensors = {}
         for pin in self._straight:
             pin.input(PULL_HIGH)
+            self._sensors.setdefault(pin._port, [0, 0])[0] |= pin._bit
         for pin in self._diverging:
             pin.input(PULL_HIGH)
-        if self.straight:
+            self._sensors.setdefault(pin._port, [0, 0])[1] |= pin._bit
+        self.timeout_ms = timeout_ms
+        self.stats = ThrowStats()
+        self.moving = False
+        self._target = None
+        self._commanded = 0
+        self._callbacks = []
+        self.position = self.state
+        if self.position == "straight":
             self.set_straight()
-        elif self.diverging:
+        elif self.position == "diverging":
             self.set_diverging()
 
+    def _sense(self, snapshot: Snapshot | None = None):
+        straight = diverging = True
+        for port, (straight_mask, diverging_mask) in self._sensors.items():
+            value = port.gpio if snapshot is None else snapshot.current[port]
+            straight_bits = value & straight_mask
+            diverging_bits = value & diverging_mask
+            if straight_bits or diverging_bits != diverging_mask:
+                straight = False
+            if diverging_bits or straight_bits != straight_mask:
+                diverging = False
+        return straight, diverging
+
+    def _command(self, target: str):
+        if self.moving and target == self._target:
+            return
+        self._target = target
+        if self.position == target and not self.moving:
+            return
+        self.moving = True
+        self._commanded = ticks_ms()
+
     @property
     def straight(self):
-        return all(not pin.value() for pin in self._straight) and all(
-            pin.value() for pin in self._diverging
-        )
+        return self._sense()[0]
 
     def set_straight(self):
+        self._command("straight")
         self._motor.output(ON)
 
     @property
     def diverging(self):
-        return all(not pin.value() for pin in self._diverging) and all(
-            pin.value() for pin in self._straight
-        )
+        return self._sense()[1]
 
     def set_diverging(self):
+        self._command("diverging")
         self._motor.output(OFF)
 
     @property
     def state(self):
-        if self.straight:
+        straight, diverging = self._sense()
+        if straight:
             return "straight"
-        if self.diverging:
+        if diverging:
             return "diverging"
         return None
 
+    @property
+    def in_position(self) -> bool:
+        # an unknown position never counts, nor does a motor never commanded
+        return self._target is not None and self.position == self._target
+
+    def poll(self, snapshot: Snapshot | None = None):
+        straight, diverging = self._sense(snapshot)
+        if straight:
+            self.position = "straight"
+        elif diverging:
+            self.position = "diverging"
+        else:
+            self.position = None
+        if not self.moving:
+            return
+        elapsed = ticks_diff(ticks_ms(), self._commanded)
+        if self.in_position:
+            self.stats.record(elapsed)
+            self._settle(True)
+        elif elapsed > self.timeout_ms:
+            self.stats.timeouts += 1
+            self._settle(False)
+
+    def _settle(self, arrived: bool):
+        self.moving = False
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self, arrived)
+
+    def when_in_position(self, callback):
+        # callback(motor, arrived) fires once the current throw completes or
+        # times out; immediately if the motor is not moving
+        if self.moving:
+            self._callbacks.append(callback)
+        else:
+            callback(self, self.in_position)
+
+    async def wait_in_position(self, interval_ms: int = 10) -> bool:
+        try:
+            import asyncio
+        except ImportError:
+            import uasyncio as asyncio
+        while self.moving:
+            self.poll()
+            if self.moving:
+                await asyncio.sleep(interval_ms / 1000)
+        return self.in_position
+
     def debug(self):
         print(
             "straight: ",
@@ -68,9 +217,14 @@ class Motor:
             "diverging: ",
             [((8 * p._port._port) + p._pin, p.value()) for p in self._diverging],
         )
+        print("throws: ", self.stats)
 
 
 class Switch:
+
+    effects: "ClassVar[leds.Effects | None]" = None
+    routes: "ClassVar[RouteTable | None]" = None
+
     def __init__(
         self, *, switch: VirtualPin, led: VirtualPin, config: dict[Motor, bool]
     ):
@@ -78,25 +232,39 @@ class Switch:
         self.switch.input(PULL_HIGH)
         self.led = led
         self.config = config
-        self._last_time = 0
+        self._last_time = None
         self._last_state = self.current_state
-        self.led.output(self.current_state)
+        self._requested = False
+        if self.effects is None:
+            self.led.output(self.current_state)
+        else:
+            self.effects.add(self.led, leds.STEADY if self._last_state else leds.OFF)
 
     def push(self):
+        self._requested = True
         for motor, diverging in self.config.items():
             if diverging:
                 motor.set_diverging()
             else:
                 motor.set_straight()
 
-    def poll_switch(self):
-        if not self.switch.value():
+    def request(self):
+        if self.routes is None:
             self.push()
+        else:
+            self.routes.request(self)
+
+    def poll_switch(self, snapshot: Snapshot | None = None):
+        if snapshot is None:
+            if not self.switch.value():
+                self.request()
+        elif snapshot.fell(self.switch):
+            self.request()
 
     @property
     def current_state(self) -> bool:
         return all(
-            motor.state == ("diverging" if diverging else "straight")
+            motor.position == ("diverging" if diverging else "straight")
             for motor, diverging in self.config.items()
         )
 
@@ -106,50 +274,125 @@ class Switch:
         # Currently reading zero
         if not current_state:
             # reset 'last time active'
-            self._last_time = 0
+            self._last_time = None
             # current state is false
             self._last_state = False
         else:
             # Currently active
             if not self._last_state:
                 # But previously inactive
-                if self._last_time == 0:
+                if self._last_time is None:
                     # Last time was not active - record new active time
-                    self._last_time = time.time()
-                elif (time.time() - self._last_time) > 0.5:
+                    self._last_time = ticks_ms()
+                elif ticks_diff(ticks_ms(), self._last_time) > 500:
                     # First active old enough, set new last state
                     self._last_state = True
         return self._last_state
 
     def poll_state(self):
-        self.led.output(self.state)
+        state = self.state
+        if self.effects is None:
+            self.led.output(state)
+            return
+        if state:
+            self._requested = False
+            pattern = leds.STEADY
+        elif self._last_time is not None or any(motor.moving for motor in self.config):
+            # in transit: blink our own route, pulse routes being disturbed
+            pattern = leds.BLINK if self._requested else leds.PULSE
+        else:
+            self._requested = False
+            pattern = leds.OFF
+        self.effects.set(self.led, pattern)
+
+
+class Lazy:
+    # Stands in for a layout object until it is first used, one of its
+    # buttons is pressed, or it is built in the background by
+    # Base.materialise_next(). Only the button inputs are configured up front;
+    # motors, sensors and LEDs wait for the object.
+    def __init__(self, cls: type, kwargs: dict):
+        self._instance = None
+        self._cls = cls
+        self._kwargs = kwargs
+        self.name = "{}#{}".format(
+            cls.__name__, len(Base.instances) + len(Base.deferred)
+        )
+        self.inputs = [pin for key, pin in kwargs.items() if key.startswith("switch")]
+        for pin in self.inputs:
+            pin.input(PULL_HIGH)
+        Base.deferred.append(self)
+
+    def pressed(self, snapshot: Snapshot | None = None) -> bool:
+        if snapshot is None:
+            return any(not pin.value() for pin in self.inputs)
+        return any(snapshot.fell(pin) for pin in self.inputs)
+
+    def materialise(self) -> "Base":
+        if self._instance is None:
+            self._instance = self._cls(**self._kwargs)
+            self._kwargs = None
+            Base.deferred.remove(self)
+            # snapshot, route table and telemetry were built without it
+            for listener in Base.listeners:
+                listener(self._instance)
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.materialise(), name)
 
 
 class Base:
 
-    instances: ClassVar[list[Base]] = []
+    instances: "ClassVar[list[Base]]" = []
+    deferred: "ClassVar[list[Lazy]]" = []
+    # called with each lazily built instance once it exists
+    listeners: "ClassVar[list]" = []
 
     def __init__(self, *, switches: list[Switch]):
         self.switches = switches
+        self.motors = []
+        for switch in switches:
+            for motor in switch.config:
+                if motor not in self.motors:
+                    self.motors.append(motor)
         self.__class__.instances.append(self)
 
-    def poll_switches(self):
+    def poll_switches(self, snapshot: Snapshot | None = None):
         for switch in self.switches:
-            switch.poll_switch()
+            switch.poll_switch(snapshot)
 
-    def poll_state(self):
+    def poll_state(self, snapshot: Snapshot | None = None):
+        for motor in self.motors:
+            motor.poll(snapshot)
         for switch in self.switches:
             switch.poll_state()
 
     @classmethod
-    def poll_all_switches(cls):
+    def lazy(cls, **kwargs) -> Lazy:
+        return Lazy(cls, kwargs)
+
+    @classmethod
+    def materialise_next(cls) -> Lazy | None:
+        if not cls.deferred:
+            return None
+        lazy = cls.deferred[0]
+        lazy.materialise()
+        return lazy
+
+    @classmethod
+    def poll_all_switches(cls, snapshot: Snapshot | None = None):
+        for lazy in cls.deferred[:]:
+            # build it now so the press below is seen by its new switches
+            if lazy.pressed(snapshot):
+                lazy.materialise()
         for instance in cls.instances:
-            instance.poll_switches()
+            instance.poll_switches(snapshot)
 
     @classmethod
-    def poll_all_states(cls):
+    def poll_all_states(cls, snapshot: Snapshot | None = None):
         for instance in cls.instances:
-            instance.poll_state()
+            instance.poll_state(snapshot)
 
     def debug(self):
         for k, v in self.__dict__.items():
@@ -158,6 +401,106 @@ class Base:
                 v.debug()
 
 
+class RouteTable:
+    def __init__(self, switches: list[Switch]):
+        self.switches = []
+        self._index = {}
+        # conflicts[i] has bit j set if switches i and j drive a shared motor
+        # in opposite directions
+        self.conflicts = []
+        for switch in switches:
+            self._add_switch(switch)
+        self._pending = []
+        self.merged = 0
+        self.dropped = 0
+        self.queued = 0
+
+    @classmethod
+    def for_layout(cls) -> "RouteTable":
+        table = cls(
+            [switch for instance in Base.instances for switch in instance.switches]
+        )
+        Base.listeners.append(table.add)
+        return table
+
+    def add(self, instance: Base):
+        for switch in instance.switches:
+            self._add_switch(switch)
+
+    def _add_switch(self, switch: Switch):
+        index = len(self.switches)
+        self.switches.append(switch)
+        self._index[switch] = index
+        self.conflicts.append(0)
+        for other_index, other in enumerate(self.switches):
+            if any(
+                motor in other.config and other.config[motor] != diverging
+                for motor, diverging in switch.config.items()
+            ):
+                self.conflicts[index] |= 1 << other_index
+                self.conflicts[other_index] |= 1 << index
+
+    def request(self, switch: Switch):
+        index = self._index[switch]
+        if index not in self._pending:
+            self._pending.append(index)
+
+    def commit(self):
+        # the latest press wins: earlier conflicting presses are dropped, even
+        # when the later one has to wait, and compatible ones are merged into
+        # one set of writes
+        accepted = 0
+        blocked = 0
+        queued = []
+        targets = {}
+        for index in reversed(self._pending):
+            if self.conflicts[index] & blocked:
+                self.dropped += 1
+                continue
+            config = self.switches[index].config
+            if any(
+                motor.moving and motor._target != target
+                for motor, target in self._targets(config)
+            ):
+                # don't reverse a motor mid-throw, retry once it settles
+                queued.append(index)
+                blocked |= 1 << index
+                continue
+            if accepted:
+                self.merged += 1
+            accepted |= 1 << index
+            blocked |= 1 << index
+            self.switches[index]._requested = True
+            targets.update(config)
+        self.queued += len(queued)
+        self._pending = queued[::-1]
+        self._apply(targets)
+
+    def _targets(self, config: dict[Motor, bool]):
+        for motor, diverging in config.items():
+            yield motor, "diverging" if diverging else "straight"
+
+    def _apply(self, targets: dict[Motor, bool]):
+        # one latch write per expander port for every motor that needs moving
+        ports = {}
+        for motor, target in self._targets(targets):
+            if motor._target == target and (motor.moving or motor.position == target):
+                continue
+            if motor._target is None:
+                # never driven, so the pin is not configured as an output yet
+                if target == "diverging":
+                    motor.set_diverging()
+                else:
+                    motor.set_straight()
+                continue
+            motor._command(target)
+            pin = motor._motor
+            level = OFF if target == "diverging" else ON
+            ports.setdefault(pin._port, [0, 0])[0 if level else 1] |= pin._bit
+        for port, (high, low) in ports.items():
+            port.gpio = (port.output_latch | high) & ~low
+
+
 class Turnout(Base):
     def __init__(
         self,
@@ -259,12 +602,12 @@ class Crossover(Base):
         self.switch_straight = Switch(
             switch=switch_straight,
             led=led_straight,
-            config={self.motor1: False, motor2: False},
+            config={self.motor1: False, self.motor2: False},
         )
         self.switch_diverging = Switch(
             switch=switch_diverging,
             led=led_diverging,
-            config={self.motor1: True, motor2: True},
+            config={self.motor1: True, self.motor2: True},
         )
         self.switch_partial = Switch(
             switch=switch_partial,